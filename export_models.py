@@ -0,0 +1,125 @@
+import os, sys, glob
+import cv2
+import numpy as np
+import torch
+import onnx
+import openvino as ov
+import nncf
+
+# 로컬에 받아 둔 yolov5 저장소를 torch.hub 로 불러온다 (매번 GitHub 에서 확인하지 않음)
+YOLOV5_DIR = './yolov5'
+
+# INT8 보정(calibration)에 쓸 이미지 폴더. 모델이 학습한 분포의 이미지여야 한다.
+# 딸기 모델은 학습 이미지를 쓰고, COCO 모델은 COCO 이미지(예: val2017) 폴더를 지정해야 한다.
+# 보정 폴더가 없는 모델은 INT8 을 만들지 않는다 (서버는 FP32 ONNX 로 동작한다).
+CUSTOM_CALIB_DIR = os.getenv('CUSTOM_CALIB_DIR', './dataset/images/train')
+COCO_CALIB_DIR = os.getenv('COCO_CALIB_DIR')
+CALIB_SIZE = 300
+CALIB_EXTS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+
+# 내보낼 모델 목록: (torch.hub 모델 이름, 가중치 경로, ONNX 경로, INT8 경로, GPU 용 FP16 ONNX 경로, 보정 이미지 폴더)
+CUSTOM_WEIGHTS = './yolov5/runs/train/exp11/weights/best.pt'
+EXPORTS = [
+    ('custom', CUSTOM_WEIGHTS, './yolov5/runs/train/exp11/weights/best.onnx',
+     './yolov5/runs/train/exp11/weights/best_int8.xml',
+     './yolov5/runs/train/exp11/weights/best_fp16.onnx', CUSTOM_CALIB_DIR),
+    ('yolov5s', None, 'yolov5s.onnx', 'yolov5s_int8.xml', 'yolov5s_fp16.onnx', COCO_CALIB_DIR),
+]
+
+def load_model(name, weights=None):
+    kwargs = {'path': weights} if weights else {'pretrained': True}
+    # CUDA 가 있어도 CPU 에 올린다. FP16 내보내기 때만 export_onnx 에서 GPU 로 옮긴다
+    model = torch.hub.load(YOLOV5_DIR, name, source='local', force_reload=False,
+                           autoshape=False, device='cpu', **kwargs)
+    # DetectMultiBackend 안의 DetectionModel 을 Conv+BN 을 합친 뒤 내보낸다
+    model = model.model.fuse().eval()
+    for m in model.modules():
+        if type(m).__name__ == 'Detect':
+            m.inplace = False
+            m.export = True
+    return model
+
+def export_onnx(model, output_path, imgsz=640, half=False):
+    dummy = torch.zeros(1, 3, imgsz, imgsz)
+    if half:
+        # FP16 은 GPU 에서만 내보낸다 (CPU 에서는 작은 모델이 오히려 느려진다)
+        model, dummy = model.to('cuda').half(), dummy.to('cuda').half()
+    with torch.no_grad():
+        torch.onnx.export(
+            model, dummy, output_path,
+            opset_version=12,
+            do_constant_folding=True,
+            input_names=['images'],
+            output_names=['output'],
+            dynamic_axes={'images': {0: 'b'}, 'output': {0: 'b'}},
+        )
+    # 클래스 이름을 메타데이터로 저장해서 서버가 torch 없이 읽을 수 있게 한다
+    onnx_model = onnx.load(output_path)
+    names = model.names
+    meta = onnx_model.metadata_props.add()
+    meta.key, meta.value = 'names', str([names[i] for i in range(len(names))])
+    onnx.save(onnx_model, output_path)
+
+# models.py 의 letterbox 와 같은 전처리. torch.hub 가 yolov5 의 models 패키지를 import 하므로
+# 이 스크립트에서는 models.py 를 import 할 수 없다.
+def letterbox(img, size=640, color=(114, 114, 114)):
+    h, w = img.shape[:2]
+    r = min(size / h, size / w)
+    nw, nh = int(round(w * r)), int(round(h * r))
+    img = cv2.resize(img, (nw, nh), interpolation=cv2.INTER_LINEAR)
+    dw, dh = (size - nw) / 2, (size - nh) / 2
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    return cv2.copyMakeBorder(img, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)
+
+def calibration_transform(path):
+    # 서버와 똑같이 전처리해야 한다: YOLOv5 는 mean/std 정규화 없이 /255 만 한다.
+    # ImageNet mean/std(0.485/0.229) 를 쓰면 INT8 mAP 가 크게 떨어진다.
+    img = letterbox(cv2.imread(path))
+    x = np.ascontiguousarray(img[:, :, ::-1].transpose(2, 0, 1)[None], dtype=np.float32)
+    return x / 255.0
+
+def calibration_paths(calib_dir):
+    # 확장자로 먼저 거르고, 읽을 수 있는 이미지를 CALIB_SIZE 장 찾으면 멈춘다
+    paths = []
+    for p in sorted(glob.glob(os.path.join(calib_dir, '*'))):
+        if p.lower().endswith(CALIB_EXTS) and cv2.imread(p) is not None:
+            paths.append(p)
+            if len(paths) == CALIB_SIZE:
+                break
+    return paths
+
+def export_int8(onnx_path, output_path, paths):
+    model = ov.convert_model(onnx_path)
+    names = onnx.load(onnx_path).metadata_props
+    model.set_rt_info(next(p.value for p in names if p.key == 'names'), ['model_info', 'names'])
+
+    calibration_dataset = nncf.Dataset(paths, calibration_transform)
+    quantized = nncf.quantize(model, calibration_dataset, preset=nncf.QuantizationPreset.MIXED,
+                              subset_size=len(paths))
+    ov.save_model(quantized, output_path)
+
+def warn(message):
+    print(f"WARNING: {message}", file=sys.stderr)
+
+if __name__ == '__main__':
+    for name, weights, onnx_path, int8_path, fp16_path, calib_dir in EXPORTS:
+        model = load_model(name, weights)
+        export_onnx(model, onnx_path)
+        print(f"Exported {name} -> {onnx_path}")
+        if torch.cuda.is_available():
+            export_onnx(model, fp16_path, half=True)
+            print(f"Exported {name} (FP16) -> {fp16_path}")
+
+        # 잘못된 보정 이미지로 INT8 을 만들면 mAP 가 무너지므로, 보정 폴더가 없으면 INT8 은 건너뛴다
+        if not calib_dir or not os.path.isdir(calib_dir):
+            warn(f"Skipping INT8 for {name}: calibration directory is missing ({calib_dir}). "
+                 f"Set COCO_CALIB_DIR to a folder of COCO images for yolov5s. "
+                 f"The server will use the FP32 ONNX model instead.")
+            continue
+        paths = calibration_paths(calib_dir)
+        if not paths:
+            warn(f"Skipping INT8 for {name}: no calibration images found in {calib_dir}.")
+            continue
+        export_int8(onnx_path, int8_path, paths)
+        print(f"Quantized {name} -> {int8_path} ({len(paths)} calibration images)")
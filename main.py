@@ -1,86 +1,277 @@
-from flask import Flask, request, jsonify, url_for
-import os, cv2, numpy as np, torch
-from datetime import datetime
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, File, Form, Request, UploadFile
+from fastapi.responses import ORJSONResponse
+from fastapi.staticfiles import StaticFiles
+import os, asyncio, itertools, uuid, cv2, numpy as np
+import xxhash
+import concurrent.futures
+import uvicorn
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
 
-app = Flask(__name__)
+from models import IMG_SIZE, MAX_BATCH, get_model, run_batch
 
-PROCESSED_DIR = os.path.join(app.root_path, 'static', 'processed')
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, 'static')
+# 운영에서는 nginx 가 직접 서빙하는 공유 볼륨에 저장하고 그 공개 URL 을 돌려준다 (deploy/nginx.conf)
+# 예: PROCESSED_DIR=/var/lib/lookback/processed PROCESSED_URL=https://cdn.example.com/processed
+# 둘 다 설정하지 않으면 이 서버의 /static/processed 로 서빙한다 (로컬 개발용).
+# 하나만 설정하면 저장 위치와 돌려주는 URL 이 어긋나 404 가 나므로 시작할 때 실패시킨다
+if bool(os.getenv('PROCESSED_DIR')) != bool(os.getenv('PROCESSED_URL')):
+    raise RuntimeError("PROCESSED_DIR and PROCESSED_URL must be set together")
+PROCESSED_DIR = os.getenv('PROCESSED_DIR') or os.path.join(STATIC_DIR, 'processed')
+PROCESSED_URL = os.getenv('PROCESSED_URL')
 os.makedirs(PROCESSED_DIR, exist_ok=True)
 
-custom_model = torch.hub.load('ultralytics/yolov5', 'custom', path='./yolov5/runs/train/exp11/weights/best.pt')
-coco_model = torch.hub.load('ultralytics/yolov5', 'yolov5s', pretrained=True)
+# 저장 파일 이름: 프로세스마다 임의 토큰 + 카운터를 쓴다.
+# 토큰은 fork 된 워커(gunicorn --preload)와 재시작마다 새로 만들어서 이전 파일/캐시된 URL 과 겹치지 않는다
+def _reset_file_token():
+    global _file_token, _counter
+    _file_token = uuid.uuid4().hex[:8]
+    _counter = itertools.count()
 
-custom_model.conf = 0.7
+_reset_file_token()
+os.register_at_fork(after_in_child=_reset_file_token)
+# 미리보기 이미지이므로 기본값(95)보다 낮은 품질로 빠르게 인코딩한다
+JPEG_PARAMS = [cv2.IMWRITE_JPEG_QUALITY, 85, cv2.IMWRITE_JPEG_OPTIMIZE, 0]
 
-def file_to_image(file_storage):
-    file_data = file_storage.read()
+SKIP_MODEL_LOAD = os.getenv('SKIP_MODEL_LOAD', '0') == '1'
+
+# 동시에 들어온 요청을 모아 한 번에 추론한다 (최대 MAX_BATCH 장, models.py 에서 설정)
+BATCH_TIMEOUT = float(os.getenv('BATCH_TIMEOUT', 0.005))
+
+# 디코딩/인코딩은 OpenCV 가 GIL 을 놓으므로 스레드 풀에서 돌린다
+DECODE_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+# 이보다 큰 JPEG 업로드(고해상도 휴대폰 사진)는 1/2 크기로 디코딩한다. YOLO 입력은 어차피 640 이다
+REDUCED_DECODE_BYTES = int(os.getenv('REDUCED_DECODE_BYTES', 2 * 1024 * 1024))
+
+# 같은 이미지가 다시 들어오면 (detect -> highlight) 추론 결과를 재사용한다
+DETECTION_CACHE_SIZE = 256
+_detection_cache = OrderedDict()
+_detection_cache_enabled = os.getenv('DETECTION_CACHE', '1') != '0'
+
+def enable_detection_cache(enabled=True):
+    global _detection_cache_enabled
+    _detection_cache_enabled = enabled
+    if not enabled:
+        _detection_cache.clear()
+
+@dataclass
+class InferenceRequest:
+    future: asyncio.Future
+    img: np.ndarray
+
+# 모델마다 큐를 따로 둬서 배치 안의 요청이 항상 같은 모델을 쓰게 한다
+_queues = {}
+_workers = []
+
+def get_queue(model_name):
+    # 첫 요청이 들어올 때 큐와 추론 코루틴을 만든다
+    queue = _queues.get(model_name)
+    if queue is None:
+        queue = _queues[model_name] = asyncio.Queue()
+        _workers.append(asyncio.create_task(inference_coroutine(model_name, queue)))
+    return queue
+
+def is_jpeg(file_data):
+    return file_data[:3] == b'\xff\xd8\xff'
+
+def image_ext(file_data):
+    # 브라우저가 그대로 보여 줄 수 있는 형식만 확장자를 돌려준다. 나머지(BMP, TIFF 등)는 None
+    if is_jpeg(file_data):
+        return 'jpg'
+    if file_data.startswith(b'\x89PNG'):
+        return 'png'
+    if file_data[:4] == b'RIFF' and file_data[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+async def decode_image(file_data, flags=cv2.IMREAD_COLOR):
     np_arr = np.frombuffer(file_data, np.uint8)
-    img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-    return img
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(DECODE_POOL, cv2.imdecode, np_arr, flags)
+
+async def file_to_image(upload):
+    file_data = await upload.read()
+    # 캐시 키일 뿐이라 암호학적 해시는 필요 없다. xxh3 는 수 MB 사진도 빠르게 해싱한다
+    key = xxhash.xxh3_64(file_data).intdigest()
+    # 감지 입력용 디코딩. 1/2 디코딩이 싼 것은 JPEG 뿐이라 큰 JPEG 만 1/2 로 디코딩하고,
+    # 줄인 이미지의 긴 변이 YOLO 입력(640)보다 작아지면 원본 크기로 다시 디코딩한다.
+    # scale 은 감지 좌표를 원본 크기로 되돌릴 배율이다
+    if is_jpeg(file_data) and len(file_data) > REDUCED_DECODE_BYTES:
+        img = await decode_image(file_data, cv2.IMREAD_REDUCED_COLOR_2)
+        if img is not None and max(img.shape[:2]) >= IMG_SIZE:
+            return img, key, file_data, 2
+    img = await decode_image(file_data)
+    return img, key, file_data, 1
 
-def save_image_to_file(img, prefix="processed"):
-    filename = f"{prefix}_{datetime.now().strftime('%Y%m%d%H%M%S')}.jpg"
+def scale_detections(detections, scale):
+    # 1/2 로 디코딩한 이미지 기준 좌표를 원본 이미지 크기로 되돌린다
+    if scale != 1:
+        for det in detections:
+            for k in ('xmin', 'ymin', 'xmax', 'ymax'):
+                det[k] *= scale
+
+def new_processed_file(request, prefix, ext):
+    filename = f"{prefix}_{_file_token}_{next(_counter)}.{ext}"
     file_path = os.path.join(PROCESSED_DIR, filename)
-    cv2.imwrite(file_path, img)
-    file_url = url_for('static', filename=f"processed/{filename}", _external=True)
+    if PROCESSED_URL:
+        file_url = f"{PROCESSED_URL.rstrip('/')}/{filename}"
+    else:
+        file_url = str(request.url_for('static', path=f"processed/{filename}"))
     return file_path, file_url
 
-def detect_objects(img, target_object):
-    if target_object.lower() == 'strawberry':
-        selected_model = custom_model
-    else:
-        selected_model = coco_model
-    results = selected_model(img)
-    df = results.pandas().xyxy[0]
-    detections = df.to_dict(orient="records")
-    if target_object.lower() == 'strawberry':
-        for det in detections:
-            det['class'] = 1
-            det['name'] = 'strawberry'
-    return detections
-
-@app.route('/detect', methods=['POST'])
-def detect():
-    if 'image' not in request.files:
-        return jsonify({"error": "Missing image file"}), 400
-    img = file_to_image(request.files['image'])
-    target_object = request.form.get('object')
+def write_bytes(file_path, data):
+    with open(file_path, 'wb') as f:
+        f.write(data)
+
+async def save_image_to_file(request, img, prefix="processed"):
+    file_path, file_url = new_processed_file(request, prefix, 'jpg')
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(DECODE_POOL, cv2.imwrite, file_path, img, JPEG_PARAMS)
+    return file_path, file_url
+
+async def _maybe_persist(request, img, drew_boxes, original_bytes, prefix):
+    # 이미지에 아무것도 그리지 않았으면 다시 인코딩하지 않고 업로드된 바이트를 그대로 저장한다.
+    # 형식을 알 수 없는 업로드는 JPEG 로 다시 인코딩한다 (1/2 디코딩은 JPEG 만 하므로 img 는 원본 크기다)
+    ext = image_ext(original_bytes)
+    if drew_boxes or ext is None:
+        return await save_image_to_file(request, img, prefix=prefix)
+    file_path, file_url = new_processed_file(request, prefix, ext)
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(DECODE_POOL, write_bytes, file_path, original_bytes)
+    return file_path, file_url
+
+def _run_batch(model_name, imgs):
+    # 커스텀 모델은 여기서 처음 로드되므로 이벤트 루프를 막지 않는다
+    return run_batch(get_model(model_name), imgs)
+
+async def inference_coroutine(model_name, queue):
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await queue.get()]
+        deadline = loop.time() + BATCH_TIMEOUT
+        while len(batch) < MAX_BATCH:
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), deadline - loop.time()))
+            except asyncio.TimeoutError:
+                break
+        try:
+            results = await loop.run_in_executor(None, _run_batch, model_name, [r.img for r in batch])
+        except Exception as e:
+            for r in batch:
+                if not r.future.done():
+                    r.future.set_exception(e)
+            continue
+        for r, pred in zip(batch, results):
+            if r.future.done():
+                continue
+            if isinstance(pred, Exception):
+                r.future.set_exception(pred)
+            else:
+                r.future.set_result(pred)
+
+async def run_model(model_name, img, key):
+    # 캐시에는 NMS 결과 배열만 넣고, 응답용 dict 는 매번 새로 만든다
+    cache_key = (key, model_name)
+    if _detection_cache_enabled and cache_key in _detection_cache:
+        _detection_cache.move_to_end(cache_key)
+        return _detection_cache[cache_key]
+    future = asyncio.get_running_loop().create_future()
+    await get_queue(model_name).put(InferenceRequest(future, img))
+    pred = await future
+    if _detection_cache_enabled:
+        pred.setflags(write=False)
+        _detection_cache[cache_key] = pred
+        if len(_detection_cache) > DETECTION_CACHE_SIZE:
+            _detection_cache.popitem(last=False)
+    return pred
+
+async def detect_objects(img, key, target_object):
+    target = target_object.lower()
+    is_strawberry = target == 'strawberry'
+    model_name = 'custom' if is_strawberry else 'coco'
+    pred = await run_model(model_name, img, key)
+    # 좌표/점수는 NumPy 스칼라 그대로 두고 ORJSONResponse 가 직렬화한다
+    if is_strawberry:
+        # 커스텀 모델의 클래스는 모두 딸기(class 1)로 내보낸다
+        return [{
+            "xmin": x1, "ymin": y1, "xmax": x2, "ymax": y2,
+            "confidence": conf, "class": 1, "name": "strawberry"
+        } for x1, y1, x2, y2, conf, _ in pred]
+    # 클래스 이름마다 target_object 포함 여부를 구해 두고, 감지 결과를 한 번에 거른다
+    selected_model = get_model(model_name)
+    class_match = np.char.find(selected_model.lower_names, target) >= 0
+    pred = pred[class_match[pred[:, 5].astype(np.int64)]]
+    names = selected_model.names
+    return [{
+        "xmin": x1, "ymin": y1, "xmax": x2, "ymax": y2,
+        "confidence": conf, "class": int(c), "name": names[int(c)]
+    } for x1, y1, x2, y2, conf, c in pred]
+
+@asynccontextmanager
+async def lifespan(app):
+    # COCO 모델은 거의 모든 요청이 쓰므로 서버 시작 시 미리 로드한다
+    # (SKIP_MODEL_LOAD=1 이면 CI/테스트에서 첫 요청까지 로드를 미룬다)
+    if not SKIP_MODEL_LOAD:
+        await asyncio.get_running_loop().run_in_executor(None, get_model, 'coco')
+    yield
+    for w in _workers:
+        w.cancel()
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+app.mount('/static', StaticFiles(directory=STATIC_DIR), name='static')
+
+@app.post('/detect')
+async def detect(request: Request,
+                 image: Optional[UploadFile] = File(None),
+                 target_object: Optional[str] = Form(None, alias='object')):
+    if image is None:
+        return ORJSONResponse({"error": "Missing image file"}, status_code=400)
+    img, key, file_data, scale = await file_to_image(image)
     if not target_object:
-        return jsonify({"error": "Missing object parameter"}), 400
+        return ORJSONResponse({"error": "Missing object parameter"}, status_code=400)
+    if img is None:
+        return ORJSONResponse({"error": "Invalid image file"}, status_code=400)
 
-    detections = detect_objects(img, target_object)
-    filtered = [d for d in detections if target_object.lower() in d['name'].lower()]
-    _, file_url = save_image_to_file(img, prefix="detect")
-    return jsonify({
+    detections = await detect_objects(img, key, target_object)
+    # 원본 바이트를 그대로 돌려주므로 좌표도 원본 크기 기준으로 돌려준다
+    scale_detections(detections, scale)
+    _, file_url = await _maybe_persist(request, img, False, file_data, prefix="detect")
+    return ORJSONResponse({
         "fileUrl": file_url,
-        "detections": filtered
+        "detections": detections
     })
 
-@app.route('/highlight', methods=['POST'])
-def highlight():
-    if 'image' not in request.files:
-        return jsonify({"error": "Missing image file"}), 400
-    img = file_to_image(request.files['image'])
-    target_object = request.form.get('object')
-    highlight_method = request.form.get('highlightMethod')
+@app.post('/highlight')
+async def highlight(request: Request,
+                    image: Optional[UploadFile] = File(None),
+                    target_object: Optional[str] = Form(None, alias='object'),
+                    highlight_method: Optional[str] = Form(None, alias='highlightMethod')):
+    if image is None:
+        return ORJSONResponse({"error": "Missing image file"}, status_code=400)
+    img, key, file_data, scale = await file_to_image(image)
     if not target_object or not highlight_method:
-        return jsonify({"error": "Missing parameters"}), 400
+        return ORJSONResponse({"error": "Missing parameters"}, status_code=400)
+    if img is None:
+        return ORJSONResponse({"error": "Invalid image file"}, status_code=400)
 
-    detections = detect_objects(img, target_object)
-    if target_object.lower() == 'strawberry':
-        for det in detections:
-            det['class'] = 0
-            det['name'] = 'strawberry'
-    filtered = [d for d in detections if target_object.lower() in d['name'].lower()]
+    detections = await detect_objects(img, key, target_object)
 
-    if highlight_method == "파란 테두리":
-        for det in filtered:
-            x1, y1 = int(det['xmin']), int(det['ymin'])
-            x2, y2 = int(det['xmax']), int(det['ymax'])
-            cv2.rectangle(img, (x1, y1), (x2, y2), (255, 0, 0), 4)
+    drew_boxes = highlight_method == "파란 테두리" and len(detections) > 0
+    if drew_boxes and scale != 1:
+        # 결과 이미지는 다음 단계의 입력이 되므로 원본 해상도로 다시 디코딩해서 그린다
+        img = await decode_image(file_data)
+        scale_detections(detections, scale)
+    if drew_boxes:
+        # 박스마다 cv2.rectangle 을 부르지 않고 (N, 4, 2) 꼭짓점 배열로 한 번에 그린다
+        boxes = np.array([[d['xmin'], d['ymin'], d['xmax'], d['ymax']] for d in detections]).astype(np.int32)
+        pts = boxes[:, [[0, 1], [2, 1], [2, 3], [0, 3]]]
+        cv2.polylines(img, list(pts), isClosed=True, color=(255, 0, 0), thickness=4, lineType=cv2.LINE_8)
 
-    _, file_url = save_image_to_file(img, prefix="highlight")
-    return jsonify({"fileUrl": file_url})
+    _, file_url = await _maybe_persist(request, img, drew_boxes, file_data, prefix="highlight")
+    return ORJSONResponse({"fileUrl": file_url})
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5001)
+    uvicorn.run(app, host='0.0.0.0', port=5001)
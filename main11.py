@@ -1,7 +1,15 @@
+import asyncio
 import logging
+import os
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
-import requests
+import httpx
+import nltk
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
 from transformers import pipeline
 import uvicorn
 
@@ -14,17 +22,39 @@ from sumy.summarizers.lex_rank import LexRankSummarizer
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+# 번역 API 호출용 HTTP 클라이언트 (연결 재사용)
+http_client = httpx.AsyncClient(timeout=10)
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    await http_client.aclose()
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+
+# 채팅 메시지는 같은 문장이 자주 반복되므로 번역 결과를 캐시한다 (성공한 번역만)
+TRANSLATION_CACHE_SIZE = 1024
+_translation_cache = OrderedDict()
 
 # 번역 함수 (LibreTranslate API 사용)
-def translate_text(text: str, src="ko", dest="en") -> str:
+async def translate_text(text: str, src="ko", dest="en") -> str:
+    cache_key = (text, src, dest)
+    if cache_key in _translation_cache:
+        _translation_cache.move_to_end(cache_key)
+        return _translation_cache[cache_key]
     try:
         url = "https://api.mymemory.translated.net/get"
         params = {"q": text, "langpair": f"{src}|{dest}"}
-        response = requests.get(url, params=params)
+        response = await http_client.get(url, params=params)
         if response.status_code == 200:
             result = response.json()
             translated_text = result["responseData"]["translatedText"]
+            # MyMemory 는 할당량 초과 등 실패도 HTTP 200 으로 돌려주고 경고문을 translatedText 에 담는다.
+            # 본문의 responseStatus 가 200 일 때만 캐시한다
+            if result.get("responseStatus") in (200, "200"):
+                _translation_cache[cache_key] = translated_text
+                if len(_translation_cache) > TRANSLATION_CACHE_SIZE:
+                    _translation_cache.popitem(last=False)
             return translated_text
         else:
             logger.error(f"Translation API error: {response.status_code}")
@@ -33,37 +63,87 @@ def translate_text(text: str, src="ko", dest="en") -> str:
         logger.error(f"Translation error: {str(e)}")
         return f"Translation error: {str(e)}"
 
-# 영어 상태에서 추출 요약을 수행하는 함수 (Sumy의 LexRank 사용)
+# SKIP_MODEL_LOAD=1 이면 NLTK 데이터와 모델을 받지 않는다 (CI/테스트에서 오프라인으로 import 만 할 때)
+SKIP_MODEL_LOAD = os.getenv('SKIP_MODEL_LOAD', '0') == '1'
+
+# 문장 분리에 필요한 NLTK punkt 데이터와 Sumy 객체는 시작할 때 한 번만 준비한다.
+# Sumy Tokenizer 는 만들 때 punkt 를 읽으므로 다운로드와 같이 건너뛴다
+if SKIP_MODEL_LOAD:
+    _TOKENIZER = None
+else:
+    nltk.download('punkt', quiet=True)
+    nltk.download('punkt_tab', quiet=True)
+    _TOKENIZER = Tokenizer("english")
+_SUMMARIZER = LexRankSummarizer()
+
+# 핵심 문장 1개만 뽑을 때 쓰는 TF-IDF 벡터라이저
+vectorizer = TfidfVectorizer(stop_words='english')
+
+# 다른 문장들과 가장 비슷한(중심이 되는) 문장 하나를 고른다. 희소 행렬 곱 한 번으로 계산한다
+def extract_top_sentence(text: str) -> str:
+    sentences = nltk.sent_tokenize(text)
+    if len(sentences) <= 1:
+        return sentences[0] if sentences else ""
+    try:
+        X = vectorizer.fit_transform(sentences)
+    except ValueError:
+        # 불용어만 있는 문장들이라 어휘가 비어 있는 경우
+        return sentences[0]
+    scores = np.asarray((X @ X.T).sum(axis=1)).ravel()
+    return sentences[int(scores.argmax())]
+
+# 영어 상태에서 추출 요약을 수행하는 함수 (1문장은 TF-IDF, 그 이상은 Sumy의 LexRank 사용)
 def extract_key_content(text: str, num_sentences: int = 1) -> str:
     try:
-        parser = PlaintextParser.from_string(text, Tokenizer("english"))
-        summarizer = LexRankSummarizer()
-        summary_sentences = summarizer(parser.document, num_sentences)
+        if num_sentences == 1:
+            return extract_top_sentence(text)
+        parser = PlaintextParser.from_string(text, _TOKENIZER)
+        summary_sentences = _SUMMARIZER(parser.document, num_sentences)
         summary = " ".join(str(sentence) for sentence in summary_sentences)
         return summary
     except Exception as e:
         logger.error("Extract key content error: %s", e)
         return "Key content extraction error"
 
-# 감정 분석: Zero-shot classification (facebook/bart-large-mnli)
-try:
-    zero_shot_classifier = pipeline("zero-shot-classification", model="facebook/bart-large-mnli")
-    candidate_labels = [
-        "anger", "disgust", "fear", "joy", "neutral", "sadness", "surprise",
-        "excitement", "contentment", "anxiety", "boredom"
-    ]
-    logger.info("Zero-shot emotion analysis model initialized successfully")
-except Exception as e:
-    zero_shot_classifier = None
-    candidate_labels = []
-    logger.error("Zero-shot emotion analysis model initialization failed: %s", e)
+# 감정 분석: 감정 분류 모델 (j-hartmann/emotion-english-distilroberta-base)
+# anger, disgust, fear, joy, neutral, sadness, surprise 7개 감정을 한 번의 forward 로 분류한다
+def load_emotion_classifier():
+    try:
+        classifier = pipeline(
+            "text-classification",
+            model="j-hartmann/emotion-english-distilroberta-base",
+            top_k=None
+        )
+        logger.info("Emotion analysis model initialized successfully")
+        # 첫 요청이 느려지지 않도록 미리 한 번 돌려 둔다 (SKIP_WARMUP=1 이면 생략)
+        if os.getenv('SKIP_WARMUP', '0') != '1':
+            classifier(["warmup"])
+        return classifier
+    except Exception as e:
+        logger.error("Emotion analysis model initialization failed: %s", e)
+        return None
+
+if SKIP_MODEL_LOAD:
+    emotion_classifier = None
+    logger.info("Emotion analysis model loading skipped")
+else:
+    emotion_classifier = load_emotion_classifier()
+
+# 감정 분석은 CPU 연산이므로 스레드 풀에서 돌려 이벤트 루프를 막지 않는다
+async def classify_emotions(text: str) -> list:
+    loop = asyncio.get_running_loop()
+    classification = await loop.run_in_executor(None, emotion_classifier, [text])
+    return [{"label": r["label"].lower(), "score": r["score"]} for r in classification[0]]
+
+async def no_emotions() -> list:
+    return []
 
 # Pydantic 모델 정의
 class MessageInput(BaseModel):
     message: str
 
 @app.post("/analyze")
-def analyze_message(input: MessageInput):
+async def analyze_message(input: MessageInput):
     results = {
         "translatedText": "",
         "happen": "",
@@ -71,7 +151,7 @@ def analyze_message(input: MessageInput):
     }
     try:
         # 1. 한국어 입력을 영어로 번역 (KO -> EN)
-        english_text = translate_text(input.message, src="ko", dest="en")
+        english_text = await translate_text(input.message, src="ko", dest="en")
         if english_text and not english_text.startswith("Translation"):
             results["translatedText"] = english_text
             logger.info("Translation (KO->EN) successful")
@@ -87,21 +167,20 @@ def analyze_message(input: MessageInput):
             key_content = "Summarization skipped"
             logger.info("No valid English text, summarization skipped")
         
-        # 3. 영어 요약 결과를 한국어로 번역 (EN -> KO)
-        korean_summary = translate_text(key_content, src="en", dest="ko")
+        # 3. 영어 요약 결과를 한국어로 번역 (EN -> KO) 과
+        # 4. 영어 번역문 기반 감정 분석은 서로 독립적이므로 동시에 실행한다
+        classify = emotion_classifier and results["translatedText"] != "Translation failed"
+        korean_summary, emotions = await asyncio.gather(
+            translate_text(key_content, src="en", dest="ko"),
+            classify_emotions(results["translatedText"]) if classify else no_emotions(),
+        )
         results["happen"] = korean_summary
         logger.info("Translation (EN->KO) of summary successful: %s", korean_summary)
-        
-        # 4. 감정 분석: 영어 번역문을 기반으로 Zero-shot 분류 수행
-        if zero_shot_classifier and results["translatedText"] != "Translation failed":
-            classification = zero_shot_classifier(results["translatedText"], candidate_labels)
-            emotions = []
-            for label, score in zip(classification["labels"], classification["scores"]):
-                emotions.append({"label": label, "score": score})
-            results["emotions"] = emotions
+
+        results["emotions"] = emotions
+        if classify:
             logger.info("Emotion analysis successful")
         else:
-            results["emotions"] = []
             logger.info("Emotion analysis skipped due to translation failure or classifier init failure")
         
         return results
@@ -115,7 +194,8 @@ def health_check():
         "status": "ok",
         "services": {
             "extractive_summarization": True,  # Sumy 사용 여부
-            "zero_shot_emotion_analysis": zero_shot_classifier is not None
+            # 기존 클라이언트 호환을 위해 키 이름은 그대로 둔다 (현재는 감정 분류 모델)
+            "zero_shot_emotion_analysis": emotion_classifier is not None
         }
     }
 
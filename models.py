@@ -0,0 +1,215 @@
+import os, ast, functools, threading, cv2, numpy as np
+import onnxruntime as ort
+import openvino as ov
+from dataclasses import dataclass, field
+from typing import Callable
+
+# export_models.py 로 미리 내보낸 모델 (ONNX FP32 / OpenVINO INT8)
+CUSTOM_ONNX = './yolov5/runs/train/exp11/weights/best.onnx'
+COCO_ONNX = 'yolov5s.onnx'
+CUSTOM_INT8 = './yolov5/runs/train/exp11/weights/best_int8.xml'
+COCO_INT8 = 'yolov5s_int8.xml'
+CUSTOM_FP16 = './yolov5/runs/train/exp11/weights/best_fp16.onnx'
+COCO_FP16 = 'yolov5s_fp16.onnx'
+IMG_SIZE = 640
+
+# SKIP_WARMUP=1 이면 모델 로드 후 예열을 건너뛴다 (로컬 개발용)
+SKIP_WARMUP = os.getenv('SKIP_WARMUP', '0') == '1'
+# 동시에 들어온 요청을 모아 한 번에 추론할 최대 배치 크기 (main.py 의 배치 큐가 쓴다)
+MAX_BATCH = int(os.getenv('MAX_BATCH', 8))
+
+# YOLO_BACKEND: auto(기본) | cuda | openvino | onnx
+#   auto     - GPU 와 FP16 모델이 있으면 cuda, INT8 모델이 있으면 openvino, 둘 다 없으면 onnx
+#   cuda     - FP16 ONNX + CUDA
+#   openvino - OpenVINO INT8 (CPU)
+#   onnx     - FP32 ONNX Runtime (CPU). INT8/FP16 정확도 비교용
+YOLO_BACKEND = os.getenv('YOLO_BACKEND', 'auto')
+
+@dataclass
+class YoloModel:
+    infer: Callable[[np.ndarray], np.ndarray]
+    names: list
+    conf: float = 0.25
+    iou: float = 0.45
+    # target_object 와 한 번에 비교하기 위한 소문자 클래스 이름 배열
+    lower_names: np.ndarray = field(init=False)
+
+    def __post_init__(self):
+        self.lower_names = np.char.lower(np.asarray(self.names, dtype=str))
+
+def load_onnx_model(path, conf=0.25):
+    so = ort.SessionOptions()
+    so.intra_op_num_threads = os.cpu_count()
+    so.inter_op_num_threads = 2
+    so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    sess = ort.InferenceSession(path, so, providers=['CPUExecutionProvider'])
+    names = ast.literal_eval(sess.get_modelmeta().custom_metadata_map['names'])
+    return YoloModel(lambda x: sess.run(None, {'images': x})[0], names, conf)
+
+def load_cuda_model(path, conf=0.25):
+    # 입력 크기가 640 으로 고정이므로 cuDNN 알고리즘을 처음에 한 번 찾아 둔다
+    so = ort.SessionOptions()
+    so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    providers = [('CUDAExecutionProvider', {'cudnn_conv_algo_search': 'EXHAUSTIVE'}), 'CPUExecutionProvider']
+    sess = ort.InferenceSession(path, so, providers=providers)
+    names = ast.literal_eval(sess.get_modelmeta().custom_metadata_map['names'])
+    def infer(x):
+        out = sess.run(None, {'images': x.astype(np.float16)})[0]
+        return out.astype(np.float32)
+    return YoloModel(infer, names, conf)
+
+def load_openvino_model(path, conf=0.25):
+    core = ov.Core()
+    model = core.read_model(path)
+    names = ast.literal_eval(model.get_rt_info(['model_info', 'names']).astype(str))
+    compiled_model = core.compile_model(model, 'CPU', {'PERFORMANCE_HINT': 'LATENCY'})
+    # compiled_model() 는 내부 InferRequest 를 공유하므로 스레드 간에 직렬화한다
+    lock = threading.Lock()
+    def infer(x):
+        with lock:
+            return compiled_model([x])[0]
+    return YoloModel(infer, names, conf)
+
+def warmup(model, max_batch=1):
+    # 첫 요청에서 생기는 그래프 초기화/커널 선택 비용을 미리 치른다.
+    # 배치 크기마다 입력 모양이 달라 커널을 다시 고르므로(cuDNN EXHAUSTIVE 등) 1..max_batch 를 모두 돌린다
+    x = preprocess([letterbox(np.zeros((IMG_SIZE, IMG_SIZE, 3), dtype=np.uint8))[0]])
+    for b in range(1, max_batch + 1):
+        model.infer(np.repeat(x, b, axis=0))
+
+def select_backend(int8_path, fp16_path):
+    if YOLO_BACKEND != 'auto':
+        return YOLO_BACKEND
+    # GPU 가 있으면 FP16 모델을 쓴다
+    if 'CUDAExecutionProvider' in ort.get_available_providers() and os.path.exists(fp16_path):
+        return 'cuda'
+    # 보정 이미지가 없어 INT8 을 만들지 않은 모델은 FP32 ONNX 로 돌린다
+    if os.path.exists(int8_path):
+        return 'openvino'
+    return 'onnx'
+
+def load_model(onnx_path, int8_path, fp16_path, conf=0.25, max_batch=1):
+    backend = select_backend(int8_path, fp16_path)
+    if backend == 'cuda':
+        if 'CUDAExecutionProvider' not in ort.get_available_providers():
+            raise RuntimeError("YOLO_BACKEND=cuda but ONNX Runtime has no CUDAExecutionProvider")
+        model = load_cuda_model(fp16_path, conf)
+    elif backend == 'onnx':
+        model = load_onnx_model(onnx_path, conf)
+    elif backend == 'openvino':
+        model = load_openvino_model(int8_path, conf)
+    else:
+        raise ValueError(f"Unknown YOLO_BACKEND: {backend}")
+    if not SKIP_WARMUP:
+        warmup(model, max_batch)
+    return model
+
+# 모델은 처음 쓸 때 한 번만 로드해서 프로세스 안에서 공유한다.
+# 딸기 요청을 받지 않는 인스턴스는 커스텀 모델을 로드하지 않는다.
+@functools.lru_cache(maxsize=None)
+def get_coco():
+    return load_model(COCO_ONNX, COCO_INT8, COCO_FP16, max_batch=MAX_BATCH)
+
+@functools.lru_cache(maxsize=None)
+def get_custom():
+    return load_model(CUSTOM_ONNX, CUSTOM_INT8, CUSTOM_FP16, conf=0.7, max_batch=MAX_BATCH)
+
+MODELS = {'coco': get_coco, 'custom': get_custom}
+
+def get_model(name):
+    return MODELS[name]()
+
+# 스레드마다 배치 칸(slot)별 640x640 letterbox 버퍼를 두고 재사용한다
+_scratch = threading.local()
+
+def _canvas(slot, size):
+    canvases = getattr(_scratch, 'canvases', None)
+    if canvases is None:
+        canvases = _scratch.canvases = []
+    while len(canvases) <= slot:
+        canvases.append(np.empty((size, size, 3), dtype=np.uint8))
+    return canvases[slot]
+
+def letterbox(img, size=IMG_SIZE, color=114, slot=0):
+    # 비율을 유지한 채 size x size 로 맞추고 남는 부분은 회색으로 채운다
+    h, w = img.shape[:2]
+    r = min(size / h, size / w)
+    nw, nh = int(round(w * r)), int(round(h * r))
+    if (nw, nh) != (w, h):
+        img = cv2.resize(img, (nw, nh), interpolation=cv2.INTER_LINEAR)
+    left = int(round((size - nw) / 2 - 0.1))
+    top = int(round((size - nh) / 2 - 0.1))
+    canvas = _canvas(slot, size)
+    canvas.fill(color)
+    canvas[top:top + nh, left:left + nw] = img
+    return canvas, r, (left, top)
+
+def preprocess(canvases):
+    # letterbox 된 배치 전체의 BGR->RGB, /255, HWC->NCHW float32 를 blobFromImages 한 번으로 처리한다.
+    # (B, 3, 640, 640) 텐서를 한 번에 만들므로 이미지별 텐서 할당과 np.concatenate 복사가 없다
+    return cv2.dnn.blobFromImages(canvases, scalefactor=1 / 255.0, size=(IMG_SIZE, IMG_SIZE),
+                                  swapRB=True, crop=False)
+
+def nms(boxes, scores, iou_thres):
+    x1, y1, x2, y2 = boxes.T
+    areas = (x2 - x1) * (y2 - y1)
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        w = np.clip(np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]), 0, None)
+        h = np.clip(np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]), 0, None)
+        inter = w * h
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-7)
+        order = rest[iou <= iou_thres]
+    return np.array(keep, dtype=np.int64)
+
+def postprocess(pred, conf_thres, iou_thres, ratio, pad, shape, max_det=300):
+    # pred: (25200, 5 + nc) = cx, cy, w, h, obj, class scores...
+    pred = pred[pred[:, 4] > conf_thres]
+    scores = pred[:, 5:] * pred[:, 4:5]
+    cls = scores.argmax(1)
+    conf = scores[np.arange(len(scores)), cls]
+    keep = conf > conf_thres
+    pred, cls, conf = pred[keep], cls[keep], conf[keep]
+
+    boxes = np.empty((len(pred), 4), dtype=np.float32)
+    boxes[:, 0] = pred[:, 0] - pred[:, 2] / 2
+    boxes[:, 1] = pred[:, 1] - pred[:, 3] / 2
+    boxes[:, 2] = pred[:, 0] + pred[:, 2] / 2
+    boxes[:, 3] = pred[:, 1] + pred[:, 3] / 2
+
+    # 클래스별로 박스를 떨어뜨려 놓고 한 번에 NMS
+    keep = nms(boxes + cls[:, None] * 7680, conf, iou_thres)[:max_det]
+    boxes, conf, cls = boxes[keep], conf[keep], cls[keep]
+
+    # letterbox 좌표 -> 원본 이미지 좌표
+    boxes -= (pad[0], pad[1], pad[0], pad[1])
+    boxes /= ratio
+    boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, shape[1])
+    boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, shape[0])
+    return np.concatenate([boxes, conf[:, None], cls[:, None]], axis=1)
+
+def run_batch(model, imgs):
+    # 여러 장을 (B, 3, 640, 640) 으로 쌓아서 한 번만 추론하고 이미지별로 후처리한다.
+    # 한 장의 전/후처리 실패가 배치 전체로 번지지 않도록, 실패한 자리에는 예외를 넣어 돌려준다.
+    results = [None] * len(imgs)
+    canvases, inputs = [], []
+    for i, img in enumerate(imgs):
+        try:
+            canvas, ratio, pad = letterbox(img, slot=len(canvases))
+        except Exception as e:
+            results[i] = e
+            continue
+        canvases.append(canvas)
+        inputs.append((i, ratio, pad))
+    if inputs:
+        preds = model.infer(preprocess(canvases))
+        for pred, (i, ratio, pad) in zip(preds, inputs):
+            try:
+                results[i] = postprocess(pred, model.conf, model.iou, ratio, pad, imgs[i].shape)
+            except Exception as e:
+                results[i] = e
+    return results
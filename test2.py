@@ -1,15 +1,19 @@
 import cv2
-import torch
 
-# 모델 로드 (예: 커스텀 모델)
-model = torch.hub.load('ultralytics/yolov5', 'custom', path='./yolov5/runs/train/exp5/weights/best.pt')
+from models import get_custom, run_batch
 
-# 테스트 이미지 로드
-img_path = '/Users/dgsw38/IdeaProjects/lookback-ai/fruits.jpg'
-img = cv2.imread(img_path)
+if __name__ == '__main__':
+    # 모델 로드 (커스텀 모델, main.py 와 같은 로더를 사용)
+    model = get_custom()
+    model.conf = 0.1
 
-model.conf = 0.1
+    # 테스트 이미지 로드
+    img_path = '/Users/dgsw38/IdeaProjects/lookback-ai/fruits.jpg'
+    img = cv2.imread(img_path)
 
-results = model(img)
-df = results.pandas().xyxy[0]
-print(df)
\ No newline at end of file
+    # (N, 6) = xmin, ymin, xmax, ymax, confidence, class
+    pred = run_batch(model, [img])[0]
+    if isinstance(pred, Exception):
+        raise pred
+    for x1, y1, x2, y2, conf, c in pred:
+        print(f"{model.names[int(c)]:<12} {conf:.2f}  ({x1:.0f}, {y1:.0f}) - ({x2:.0f}, {y2:.0f})")